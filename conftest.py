@@ -0,0 +1,13 @@
+import os
+import pytest
+
+# Never download PROJ grids during the tests, every CRS used here is defined without them
+os.environ.setdefault('PROJ_NETWORK', 'OFF')
+
+
+@pytest.fixture(scope='session', autouse=True)
+def warm_proj():
+	"""Open the PROJ database once per worker before any test builds a CRS."""
+	import pyproj
+	for epsg_code in [4326, 2774, 3395]:
+		pyproj.CRS.from_epsg(epsg_code)
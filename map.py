@@ -10,14 +10,92 @@ The method creates a local directory called 'trail-mileage-maps' and saves the m
 directory.
 """
 
+import functools
+import hashlib
+import json
 import os
 import pathlib
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection, PathCollection
+from matplotlib.path import Path
 import osmnx
 import geopandas as gpd
+import numpy as np
 import pandas as pd
+import shapely
 from shapely.geometry import Polygon
-from pyproj import Transformer
+from pyproj import Geod, Transformer
+
+_PROJECTIONS_FILE = (pathlib.Path(__file__).resolve().parent
+                     / 'projections_data' / 'projections.geojson')
+
+# Cache Overpass and Nominatim responses on disk so repeated runs skip the network, and keep
+# parsed feature layers as GeoParquet so repeated runs also skip building the GeoDataFrames
+osmnx.settings.use_cache = True
+osmnx.settings.cache_folder = '.osmnx_cache'
+_LAYER_CACHE_FOLDER = pathlib.Path('.layer_cache')
+
+# Surfaces on which a footway is counted as a trail
+_TRAIL_SURFACES = frozenset(['gravel', 'dirt', 'grass', 'compacted', 'earth', 'ground', 'rock'])
+
+# OSM tag columns kept for each feature layer, every other layer only keeps its geometry
+_LAYER_COLUMNS = {'trails': ['highway', 'surface']}
+
+# Drawing order and style of each feature layer on the map
+LAYER_STYLES = [
+    ('mask', {'color': '#ECF2D4', 'zorder': float('-inf')}),
+    ('trails', {'color': '#BA6461', 'linestyle': 'dashed', 'linewidth': 0.6,
+                'zorder': float('inf')}),
+    ('water', {'color': '#9FD9E9', 'rasterized': True}),
+    ('streets', {'color': '#FFFFFF', 'linewidth': 0.6, 'rasterized': True}),
+    ('roads', {'color': '#F9E9A0', 'linewidth': 1.5, 'rasterized': True}),
+    ('highways', {'color': '#F3CD71', 'linewidth': 2, 'rasterized': True}),
+    ('parks', {'color': '#CEDFC2', 'rasterized': True}),
+    ('buildings', {'color': '#D4D1CB', 'rasterized': True}),
+]
+
+# Maps are drawn on a single reusable figure, guarded by a lock while it is drawn and saved
+_FIGURE = None
+_FIGURE_LOCK = threading.Lock()
+
+def _mask_from_bbox(north_bound: float, south_bound: float, east_bound: float,
+                    west_bound: float) -> gpd.GeoDataFrame:
+    """Create polygon boundary from a bounding box.
+    Args:
+        north_bound: The northern latitude of the bounding box.
+        south_bound: The southern latitude of the bounding box.
+        east_bound: The eastern longitude of the bounding box.
+        west_bound: The western longitude of the bounding box.
+    Returns:
+        A polygon boundary representing the bounding box.
+    """
+    mask = Polygon([(west_bound, south_bound),
+                    (west_bound, north_bound),
+                    (east_bound, north_bound),
+                    (east_bound, south_bound)]
+                    )
+
+    return gpd.GeoDataFrame({'geometry' : [mask]})
+
+@functools.lru_cache(maxsize=128)
+def _mask_from_place(placename: str) -> gpd.GeoDataFrame:
+    """Geocode a placename to its polygon boundary once per process.
+    Args:
+        placename: A placename that Nominatim/OpenStreetMap recognizes.
+    Returns:
+        A polygon boundary representing the placename.
+    Raises:
+        ValueError: If the placename cannot be geocoded.
+    """
+    try:
+        return osmnx.geocode_to_gdf(placename)
+    except ValueError as e:
+        raise ValueError(f'Unable to geocode area {placename}: {e}')
 
 def create_mask(area) -> gpd.GeoDataFrame:
     """Create polygon boundary for feature layers based on bounding box or placename.
@@ -31,106 +109,263 @@ def create_mask(area) -> gpd.GeoDataFrame:
     """
     if isinstance(area, list):
         if len(area) != 4:
-            raise ValueError('List must contain exactly'
+            raise ValueError('List must contain exactly '
                             'four coordinates: [north, south, east, west]')
-        north_bound, south_bound, east_bound, west_bound = area
-        mask = Polygon([(west_bound, south_bound),
-                        (west_bound, north_bound),
-                        (east_bound, north_bound),
-                        (east_bound, south_bound)]
-                        )
-
-        return gpd.GeoDataFrame({'geometry' : [mask]})
+        return _mask_from_bbox(*area)
 
     if isinstance(area, str):
-        try:
-            mask = osmnx.geocode_to_gdf(area)
-            return mask
-        except ValueError as e:
-            raise ValueError(f'Unable to geocode area {area}: {e}')
+        # Copy the cached boundary so callers can't modify it for later lookups
+        return _mask_from_place(area).copy()
 
     else:
-        raise TypeError('Area of interest must be described by string or list of'
+        raise TypeError('Area of interest must be described by string or list of '
                          'four coordinates [north, south, east, west]')
 
-def get_features(area, feature_layers_payload: dict) -> dict:
-    """Fetch desired feature layers from OpenStreetMap.
+def _merge_tags(feature_layers_payload: dict) -> dict:
+    """Combine the OpenStreetMap tags of every feature layer into a single set of tags.
     Args:
-        area: A list of four coordinates [north, south, east, west] or placename as a string.
         feature_layers_payload: A dictionary used to find tags on OpenStreetMap.
     Returns:
-        A dictionary of GeoDataFrames for each feature layer tag.
+        A dictionary of tags matching the features of every feature layer.
+    """
+    merged_tags = {}
+    for tags in feature_layers_payload.values():
+        for key, values in tags.items():
+            if values is True or merged_tags.get(key) is True:
+                merged_tags[key] = True
+            else:
+                values = [values] if isinstance(values, str) else list(values)
+                merged_tags[key] = list(dict.fromkeys(merged_tags.get(key, []) + values))
+    return merged_tags
+
+def _match_layers(features: gpd.GeoDataFrame, feature_layers_payload: dict) -> dict:
+    """Find the features that match any of the tags of each feature layer.
+    Args:
+        features: A GeoDataFrame of features fetched from OpenStreetMap.
+        feature_layers_payload: A dictionary used to find tags on OpenStreetMap.
+    Returns:
+        A dictionary of boolean arrays which are True for every feature belonging to each layer.
+    """
+    layer_matches = {tag: np.zeros(len(features), dtype=bool) for tag in feature_layers_payload}
+    for key in dict.fromkeys(key for tags in feature_layers_payload.values() for key in tags):
+        if key not in features.columns:
+            continue
+
+        # Encode the tag column once, then look up each layer's values among its unique values
+        codes, uniques = pd.factorize(features[key])
+        for tag, tags in feature_layers_payload.items():
+            if key not in tags:
+                continue
+            if tags[key] is True:
+                layer_matches[tag] |= codes >= 0
+            else:
+                values = [tags[key]] if isinstance(tags[key], str) else tags[key]
+                # Missing tags are encoded as -1, which picks the trailing False
+                value_matches = np.append(uniques.isin(values), False)
+                layer_matches[tag] |= value_matches[codes]
+    return layer_matches
+
+def _layer_cache_path(mask_polygon: shapely.Geometry, tag: str, tags: dict) -> pathlib.Path:
+    """Find where a feature layer fetched for the area of interest is cached.
+    Args:
+        mask_polygon: A shapely geometry representing the area of interest.
+        tag: The name of the feature layer.
+        tags: The OpenStreetMap tags of the feature layer.
+    Returns:
+        The path of the feature layer's GeoParquet file.
+    """
+    key = json.dumps([mask_polygon.wkb_hex, tag, tags, _LAYER_COLUMNS.get(tag, [])],
+                     sort_keys=True)
+    return _LAYER_CACHE_FOLDER / f'{hashlib.sha1(key.encode()).hexdigest()}.parquet'
+
+def _fetch_layers(mask_polygon: shapely.Geometry, feature_layers_payload: dict) -> dict:
+    """Fetch every feature layer from OpenStreetMap with a single Overpass query.
+    Args:
+        mask_polygon: A shapely geometry representing the area of interest.
+        feature_layers_payload: A dictionary used to find tags on OpenStreetMap.
+    Returns:
+        A dictionary of GeoDataFrames for each feature layer tag, including empty layers.
     Raises:
-        ValueError: If a feature layer cannot be retrieved from OpenStreetMap.
-        TypeError: If the area is described as neither a placename or bounding box.
+        ValueError: If the features cannot be retrieved from OpenStreetMap.
     """
+    try:
+        features = osmnx.features.features_from_polygon(mask_polygon,
+                                                        tags=_merge_tags(feature_layers_payload))
+    except ValueError as e:
+        print(f'Error fetching features: {e} \n'
+              'https://osmnx.readthedocs.io/en/stable/user-reference.html')
+        raise ValueError('No feature layers were fetched.') from e
+
     feature_layers = {}
-    if isinstance(area, list):
-        for tag in feature_layers_payload.keys():
-            try:
-                feature_layers[tag] = osmnx.features.features_from_bbox(
-                    *area,
-                    tags=feature_layers_payload.get(tag)
-                )
-            except ValueError as e:
-                print(f'Error fetching features for {tag}: {e} \n'
-                      'https://osmnx.readthedocs.io/en/stable/user-reference.html')
-                continue
+    for tag, matches in _match_layers(features, feature_layers_payload).items():
+        # Drop the OSM tag columns that are never read so they aren't copied by every later step
+        columns = [column for column in _LAYER_COLUMNS.get(tag, []) if column in features.columns]
+        feature_layers[tag] = features.loc[matches, columns + [features.geometry.name]]
+    return feature_layers
 
-    elif isinstance(area, str):
-        for tag in feature_layers_payload.keys():
-            try:
-                feature_layers[tag] = osmnx.geometries_from_place(
-                    area,
-                    tags=feature_layers_payload.get(tag)
-                )
-            except ValueError as e:
-                print(f'Error fetching features for {tag}: {e} \n'
-                      'https://osmnx.readthedocs.io/en/stable/user-reference.html')
+def get_features(mask: gpd.GeoDataFrame, feature_layers_payload: dict) -> dict:
+    """Fetch desired feature layers within the mask boundary from OpenStreetMap.
+    Args:
+        mask: A polygon boundary representing the area of interest.
+        feature_layers_payload: A dictionary used to find tags on OpenStreetMap.
+    Returns:
+        A dictionary of GeoDataFrames for each feature layer tag.
+    Raises:
+        TypeError: If the payload does not map each feature layer to a dictionary of tags.
+        ValueError: If no feature layers can be retrieved from OpenStreetMap.
+    """
+    # Reject malformed payloads before any request is sent to OpenStreetMap
+    if not isinstance(feature_layers_payload, dict) or not all(
+            isinstance(tags, dict) for tags in feature_layers_payload.values()):
+        raise TypeError('Feature layers payload must map each feature layer to a dictionary '
+                        'of OpenStreetMap tags')
 
+    # Query Overpass with the mask itself so features outside of it are never downloaded
+    mask_polygon = mask.geometry.unary_union
+
+    # Read the layers from a previous run over the same area if they have all been cached
+    cache_paths = {tag: _layer_cache_path(mask_polygon, tag, tags)
+                   for tag, tags in feature_layers_payload.items()}
+    if all(path.exists() for path in cache_paths.values()):
+        fetched_layers = {tag: gpd.read_parquet(path) for tag, path in cache_paths.items()}
     else:
-        raise TypeError('Area of interest must be described by string or list of'
-                        'four coordiantes [north, south, east, west]')
+        fetched_layers = _fetch_layers(mask_polygon, feature_layers_payload)
+        _LAYER_CACHE_FOLDER.mkdir(exist_ok=True)
+        for tag, gdf in fetched_layers.items():
+            # Write each layer to a temporary file and move it into place, so maps running in
+            # other processes never read a partially written layer
+            file_descriptor, partial_path = tempfile.mkstemp(suffix='.tmp', dir=_LAYER_CACHE_FOLDER)
+            os.close(file_descriptor)
+            try:
+                gdf.to_parquet(partial_path, engine='pyarrow')
+                os.replace(partial_path, cache_paths[tag])
+            except BaseException:
+                os.remove(partial_path)
+                raise
+
+    feature_layers = {}
+    for tag, gdf in fetched_layers.items():
+        if gdf.empty:
+            print(f'No features found for {tag}')
+            continue
+        feature_layers[tag] = gdf
 
-    # Filter dictionary to include only GeoDataFrame values
     if not feature_layers:
         raise ValueError('No feature layers were fetched.')
-    return {tag: gdf for tag, gdf in feature_layers.items() if isinstance(gdf, gpd.GeoDataFrame)}
+    return feature_layers
+
+def _clip_to_mask(gdf: gpd.GeoDataFrame, mask_polygon: shapely.Geometry,
+                  mask_bounds: tuple = None) -> gpd.GeoDataFrame:
+    """Clip a feature layer to the mask boundary using its spatial index.
+    Args:
+        gdf: A GeoDataFrame containing the geometries of a feature layer.
+        mask_polygon: A shapely geometry representing the area of interest.
+        mask_bounds: The (xmin, ymin, xmax, ymax) bounds of the mask if it is a rectangle, which
+            lets crossing geometries be clipped with shapely.clip_by_rect instead.
+    Returns:
+        The rows of the feature layer that intersect the mask, with their geometries clipped to it.
+    """
+    shapely.prepare(mask_polygon)
+
+    # Only keep the geometries that the spatial index reports as touching the mask
+    intersecting_indices = np.sort(gdf.sindex.query(mask_polygon, predicate='intersects'))
+    clipped_gdf = gdf.iloc[intersecting_indices].copy()
+
+    # Geometries entirely inside the mask are kept as they are, only those crossing it are cut
+    geometries = clipped_gdf.geometry.to_numpy()
+    crossing = ~shapely.contains_properly(mask_polygon, geometries)
+    if crossing.any():
+        if mask_bounds is not None:
+            clipped_geometries = shapely.clip_by_rect(geometries[crossing], *mask_bounds)
+        else:
+            clipped_geometries = shapely.intersection(geometries[crossing], mask_polygon)
+        clipped_gdf.loc[crossing, clipped_gdf.geometry.name] = clipped_geometries
+
+        # Geometries that only touch the mask are cut down to nothing, so drop them like gpd.clip
+        clipped_gdf = clipped_gdf.loc[~clipped_gdf.geometry.is_empty]
+    return clipped_gdf
 
-def clip_layers( mask: gpd.GeoDataFrame, feature_layers: dict) -> dict:
+def clip_layers(mask_polygon: shapely.Geometry, feature_layers: dict) -> dict:
     """Clip feature layers that extend beyond the mask boundary.
     Args:
-        mask: A polygon boundary representing the area of interest.
+        mask_polygon: A shapely geometry representing the area of interest.
         feature_layers: A dictionary of GeoDataFrames that contain the geometries of each layer.
     Returns:
-        An updated feature layers dictionary where each geometry is clipped to the mask boundary.
+        An updated feature layers dictionary where each geometry is clipped to the mask boundary,
+        and the mask itself is included as a GeoDataFrame under the 'mask' key for plotting.
     """
-    clipped_layers = {key: gpd.clip(gdf,mask) for key, gdf in feature_layers.items()}
-    clipped_layers['mask'] = mask
+    # Prepare the mask once so the predicate tests against every layer reuse its edge index
+    shapely.prepare(mask_polygon)
+
+    # Bounding box masks can take the faster rectangle clipping path
+    mask_bounds = None
+    if shapely.equals(mask_polygon, shapely.envelope(mask_polygon)):
+        mask_bounds = tuple(shapely.bounds(mask_polygon))
+
+    # GEOS releases the GIL while clipping, so each layer is clipped on its own thread
+    max_workers = max(min(len(feature_layers), os.cpu_count() or 1), 1)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {key: executor.submit(_clip_to_mask, gdf, mask_polygon, mask_bounds)
+                   for key, gdf in feature_layers.items()}
+        clipped_layers = {key: future.result() for key, future in futures.items()}
+    clipped_layers['mask'] = gpd.GeoDataFrame(geometry=[mask_polygon], crs='EPSG:4326')
     return clipped_layers
 
-def get_map_projection(mask: gpd.GeoDataFrame) -> str:
-    """Find the most appropriate projected coordinate system for the area of interest.
-    Args:
-        mask: A polygon boundary representing the area of interest.
+@functools.lru_cache(maxsize=None)
+def _load_projections() -> tuple:
+    """Load the available projections and index their boundaries once per process.
     Returns:
-        The best fitting projected coordinate system as a string.
+        A GeoDataFrame of projection boundaries, an STRtree built over those boundaries and an
+        array containing the geodesic area of each boundary in square meters.
     """
-    mask_polygon = mask['geometry'].iloc[0]
-    mask_centroid = mask_polygon.centroid
+    map_projections = gpd.read_file(_PROJECTIONS_FILE, engine='pyogrio', use_arrow=True)
 
-    # Load available projections and select the ones that contain the mask centroid
-    projections_data_fp = pathlib.Path().resolve() / 'projections_data'
-    map_projections = gpd.read_file(f'{projections_data_fp}/projections.geojson')
-    valid_map_projections = map_projections.loc[map_projections['geometry'].contains(mask_centroid)]
+    # Split each boundary at the prime meridian so rings spanning every longitude do not collapse,
+    # then densify the edges so they follow parallels rather than geodesics
+    hemispheres = shapely.box([-180, 0], -90, [0, 180], 90)
+    boundary_halves = shapely.intersection(map_projections.geometry.to_numpy()[:, np.newaxis],
+                                           hemispheres)
+    boundary_halves = shapely.segmentize(boundary_halves, max_segment_length=1.0)
 
-    # Reproject to World Mercator to avoid calculating area with a geographic CRS
-    valid_map_projections = valid_map_projections.to_crs('EPSG:3395')
+    # Measure area on the ellipsoid instead of reprojecting every boundary to World Mercator
+    geod = Geod(ellps='WGS84')
+    projection_areas = np.array([sum(abs(geod.geometry_area_perimeter(half)[0]) for half in halves)
+                                 for halves in boundary_halves])
+    projections_tree = shapely.STRtree(map_projections.geometry.values)
+    return map_projections, projections_tree, projection_areas
+
+@functools.lru_cache(maxsize=128)
+def _projection_at(longitude: float, latitude: float) -> str:
+    """Find the smallest available projection containing a point.
+    Args:
+        longitude: The longitude of the point.
+        latitude: The latitude of the point.
+    Returns:
+        The code of the projected coordinate system as a string.
+    Raises:
+        ValueError: If none of the available projections contain the point.
+    """
+    # Select the available projections that contain the point
+    map_projections, projections_tree, projection_areas = _load_projections()
+    valid_indices = projections_tree.query(shapely.Point(longitude, latitude), predicate='within')
+    if len(valid_indices) == 0:
+        raise ValueError(f'No available projection covers ({longitude}, {latitude})')
 
     # Choose the projection with the smallest area to minimize distortion
-    chosen_projection = valid_map_projections.loc[valid_map_projections.geometry.area.idxmin()]
-    chosen_projection_code = chosen_projection.code
-    return chosen_projection_code
+    chosen_index = valid_indices[np.argmin(projection_areas[valid_indices])]
+    return map_projections['code'].iat[chosen_index]
+
+def get_map_projection(mask_polygon: shapely.Geometry) -> str:
+    """Find the most appropriate projected coordinate system for the area of interest.
+    Args:
+        mask_polygon: A shapely geometry representing the area of interest.
+    Returns:
+        The best fitting projected coordinate system as a string.
+    Raises:
+        ValueError: If none of the available projections cover the centroid of the area.
+    """
+    mask_centroid = mask_polygon.centroid
+    return _projection_at(mask_centroid.x, mask_centroid.y)
 
 def filter_trails(trails: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
     """Merge paths and footways after filtering out non trail surfaces.
@@ -140,71 +375,165 @@ def filter_trails(trails: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
     Returns:
         An updated GeoDataFrame that contains all paths and footways with valid trail surfaces.
     """
-    path_segments = trails.loc[trails['highway'] == 'path']
-    path_segments = path_segments.loc[path_segments['surface'] != 'concrete']
-    footway_segments = trails.loc[trails['highway'] == 'footway']
-    trail_surfaces = ['gravel', 'dirt', 'grass', 'compacted', 'earth', 'ground', 'rock']
-    footway_segments = footway_segments.loc[footway_segments['surface'].isin(trail_surfaces)]
-    trails = pd.concat([footway_segments, path_segments])
-    return trails
-
-def calculate_trail_miles(mask: gpd.GeoDataFrame, trails: gpd.GeoDataFrame) -> dict:
-    """Calculate total trail mileage within area of interest according to chosen CRS.
+    highway = trails['highway']
+    surface = trails['surface']
+
+    # Select both segment types with a single mask to avoid intermediate frames and a concat
+    path_segments = (highway == 'path') & (surface != 'concrete')
+    footway_segments = (highway == 'footway') & surface.isin(_TRAIL_SURFACES)
+    return trails.loc[path_segments | footway_segments]
+
+@functools.lru_cache(maxsize=64)
+def _get_transformer(projection: str) -> Transformer:
+    """Build a transformer from EPSG:4326 to a projected coordinate system once per projection.
     Args:
-        mask: A polygon boundary representing the area of interest.
-        trails: A GeoDataFrame representing the trails feature layer within the area of interest.
+        projection: The code of the projected coordinate system, e.g. 'EPSG:2774'.
     Returns:
-        A dictionary containing the keys 'projection' and 'trail_miles', which point to the
-        chosen PCS and the calculated trail mileage respectively.
+        A pyproj Transformer which takes (longitude, latitude) pairs.
     """
-    chosen_projection = get_map_projection(mask)
-    trails_projected = trails.to_crs(chosen_projection)
-    trail_miles = round(sum(trails_projected['geometry'].length)/1609.344,3)
-    try:
-        # Only calculate mask area/trail density for single polygons.
-        mask_4326_coords = list(mask['geometry'][0].exterior.coords)
-        
-        # Create list of (longitude, latitude) tuples using the chosen CRS.
-        transformer = Transformer.from_crs('EPSG:4326', chosen_projection, always_xy=True)
-        mask_projected_coords = [transformer.transform(lon, lat) for lon, lat in mask_4326_coords]
-        
-        # Calculate average trail mileage per square mile within area of interest.
-        mask_projected_area = Polygon(mask_projected_coords).area/2589990
-        trail_density_per_mile = round(trail_miles/mask_projected_area, 3)
-        return {'projection' : chosen_projection,
-                'trail_miles' : trail_miles,
-                'trail_density_per_mile' : trail_density_per_mile}
-    
-    # If area of interest is a multipolygon, don't calculate trail density.
-    except AttributeError:
-        return {'projection' : chosen_projection, 'trail_miles' : trail_miles}
+    return Transformer.from_crs('EPSG:4326', projection, always_xy=True)
+
+def _project(geometries: np.ndarray, projection: str) -> np.ndarray:
+    """Reproject geometries from EPSG:4326 using the cached transformer for a projection.
+    Args:
+        geometries: An array of shapely geometries with (longitude, latitude) coordinates.
+        projection: The code of the projected coordinate system, e.g. 'EPSG:2774'.
+    Returns:
+        A new array containing the geometries in the projected coordinate system.
+    """
+    transformer = _get_transformer(projection)
+
+    # Transform the coordinates of all geometries with one vectorized call through PROJ
+    def transform_coords(coords):
+        return np.column_stack(transformer.transform(coords[:, 0], coords[:, 1]))
+
+    return shapely.transform(geometries, transform_coords)
+
+def project_layers(clipped_layers: dict, projection: str) -> dict:
+    """Reproject every clipped feature layer to the chosen CRS.
+    Args:
+        clipped_layers: Dictionary of GeoDataFrames which contain the feature layers clipped to the
+        mask boundary.
+        projection: The projected coordinate system to reproject the feature layers to.
+    Returns:
+        A dictionary of the same feature layers in the chosen CRS.
+    """
+    # Every layer shares the cached transformer rather than building its own PROJ pipeline
+    return {tag: layer.set_geometry(_project(layer.geometry.to_numpy(), projection), crs=projection)
+            for tag, layer in clipped_layers.items()}
+
+def calculate_trail_miles(mask_polygon: shapely.Geometry, trails: gpd.GeoDataFrame) -> dict:
+    """Calculate total trail mileage and trail density within area of interest.
+    Args:
+        mask_polygon: A shapely geometry representing the area of interest in a projected CRS.
+        trails: A GeoDataFrame representing the trails feature layer within the area of interest
+        in the same projected CRS.
+    Returns:
+        A dictionary containing the keys 'trail_miles' and 'trail_density_per_mile', which point
+        to the calculated trail mileage and trail miles per square mile respectively.
+    """
+    trail_miles = round(float(shapely.length(trails.geometry.to_numpy()).sum())/1609.344, 3)
+
+    # Calculate the mask area in square miles, which also works for multipolygons
+    mask_area = shapely.area(mask_polygon)/2589988.110336
+    trail_density_per_mile = round(trail_miles/mask_area, 3)
+    return {'trail_miles' : trail_miles, 'trail_density_per_mile' : trail_density_per_mile}
+
+def _get_figure():
+    """Get the reusable map figure, creating it on first use and clearing it otherwise.
+    Returns:
+        The map figure and its axes.
+    """
+    global _FIGURE
+    if _FIGURE is None:
+        _FIGURE, ax = plt.subplots(figsize=(12,8))
+    else:
+        ax = _FIGURE.axes[0]
+        ax.clear()
+    return _FIGURE, ax
+
+def _plot_geometries(ax, geometries: np.ndarray, color: str, linestyle: str = 'solid',
+                     linewidth: float = None, **kwargs):
+    """Draw geometries on the map with a single matplotlib collection per geometry type.
+    Args:
+        ax: The matplotlib axes to draw on.
+        geometries: An array of shapely geometries.
+        color: The color of the geometries.
+        linestyle: The style of lines and polygon edges.
+        linewidth: The width of lines and polygon edges, or None for matplotlib's default.
+        **kwargs: Additional artist properties, e.g. zorder or rasterized.
+    Returns:
+        None
+    """
+    # Break multi-part geometries and collections down into points, lines and polygons
+    parts = geometries[~shapely.is_empty(geometries)]
+    while (shapely.get_type_id(parts) > 3).any():
+        parts = shapely.get_parts(parts)
+    parts = parts[~shapely.is_empty(parts)]
+    type_ids = shapely.get_type_id(parts)
+    line_kwargs = dict(kwargs, linestyles=linestyle)
+    if linewidth is not None:
+        line_kwargs['linewidths'] = linewidth
+
+    polygons = parts[type_ids == 3]
+    if len(polygons):
+        # Build one compound path per polygon so that its interior rings are drawn as holes
+        rings, ring_polygons = shapely.get_rings(polygons, return_index=True)
+        coords, coord_rings = shapely.get_coordinates(rings, return_index=True)
+        ring_starts = np.flatnonzero(np.diff(coord_rings, prepend=-1))
+        codes = np.full(len(coords), Path.LINETO, dtype=Path.code_type)
+        codes[ring_starts] = Path.MOVETO
+        codes[np.append(ring_starts[1:], len(coords)) - 1] = Path.CLOSEPOLY
+        polygon_starts = np.flatnonzero(np.diff(ring_polygons[coord_rings])) + 1
+        paths = [Path(vertices, path_codes) for vertices, path_codes
+                 in zip(np.split(coords, polygon_starts), np.split(codes, polygon_starts))]
+        ax.add_collection(PathCollection(paths, facecolors=color, edgecolors=color,
+                                         **line_kwargs))
+
+    lines = parts[(type_ids == 1) | (type_ids == 2)]
+    if len(lines):
+        coords, coord_lines = shapely.get_coordinates(lines, return_index=True)
+        segments = np.split(coords, np.flatnonzero(np.diff(coord_lines)) + 1)
+        ax.add_collection(LineCollection(segments, colors=color, **line_kwargs))
+
+    points = parts[type_ids == 0]
+    if len(points):
+        coords = shapely.get_coordinates(points)
+        ax.scatter(coords[:, 0], coords[:, 1], color=color, **kwargs)
 
 def show(clipped_layers, plot_title):
     """Visualize the clipped feature layers within the area of interest.
     Args:
         clipped_layers: Dictionary of GeoDataFrames which contain the feature layers fetched from
-        OpenStreetMap and clipped to the mask boundary.
+        OpenStreetMap, clipped to the mask boundary and usually reprojected to a projected CRS.
         plot_title: String displaying chosen projection system and total trail mileage caluclated.
     Returns:
-        None
+        The matplotlib figure the feature layers were drawn on.
     """
-    _, ax = plt.subplots(figsize=(12,8))
+    figure, ax = _get_figure()
     ax.set_title(plot_title)
 
-    def plot_layer(name, color, **kwargs):
-        if name in clipped_layers:
-            clipped_layers.get(name).plot(ax=ax, color=color, **kwargs)
-        else:
+    # Polygon fills are drawn below lines, so rasterize everything beneath the lines into one
+    # background image. The line layers other than trails are also rasterized so the PDF embeds
+    # one image per layer instead of every geometry, while the trails stay sharp as vectors.
+    ax.set_rasterization_zorder(1.5)
+    for name, style in LAYER_STYLES:
+        layer = clipped_layers.get(name)
+        if layer is None or layer.empty:
             print(f'No {name} to map')
+            continue
+        _plot_geometries(ax, layer.geometry.to_numpy(), **style)
 
-    plot_layer('mask', '#ECF2D4', zorder=float('-inf'))
-    plot_layer('trails', '#BA6461', linestyle='dashed', linewidth=0.6, zorder=float('inf'))
-    plot_layer('water', '#9FD9E9')
-    plot_layer('streets', '#FFFFFF', linewidth=0.6)
-    plot_layer('roads', '#F9E9A0', linewidth=1.5)
-    plot_layer('highways','#F3CD71', linewidth=2)
-    plot_layer('parks', '#CEDFC2')
-    plot_layer('buildings', '#D4D1CB')
+    # Fit the view to the layers. Projected layers have equal x and y units, while
+    # longitude/latitude coordinates need their aspect ratio corrected for the mask's latitude
+    ax.autoscale_view()
+    mask = clipped_layers.get('mask')
+    if mask is not None and mask.crs is not None and mask.crs.is_geographic:
+        _, south_bound, _, north_bound = mask.total_bounds
+        ax.set_aspect(1 / np.cos(np.radians((south_bound + north_bound) / 2)))
+    else:
+        ax.set_aspect('equal')
+    return figure
 
 def create_trail_mileage_map(area, feature_layers_payload):
     """Main function to create and save a trail mileage map as a .pdf.
@@ -215,28 +544,61 @@ def create_trail_mileage_map(area, feature_layers_payload):
         0
     """
     mask = create_mask(area)
-    feature_layers = get_features(area, feature_layers_payload)
-    clipped_layers = clip_layers(mask, feature_layers)
+    feature_layers = get_features(mask, feature_layers_payload)
+
+    # Pass the bare mask geometry through the rest of the pipeline
+    mask_polygon = mask.geometry.unary_union
+
+    # Filter trails before clipping them so discarded segments are never intersected
+    feature_layers['trails'] = filter_trails(feature_layers['trails'])
+    clipped_layers = clip_layers(mask_polygon, feature_layers)
+
     try:
-        clipped_layers['trails'] = filter_trails(clipped_layers['trails'])
-        trails_projected = calculate_trail_miles(mask, clipped_layers['trails'])
-        if 'trail_density_per_mile' in trails_projected:
-            plot_title =  (f"{trails_projected['trail_miles']} Miles of Trail"
-                           f" ({trails_projected['trail_density_per_mile']} Miles/ Square Mile)"
-                           f" Within Area of Interest Based on"
-                           f" {str(trails_projected['projection']).upper()} Projection.")
-        else:
-            plot_title =  (f"{trails_projected['trail_miles']}"
-            f" Miles of Trail Within Area of Interest"
-            f" Based on {str(trails_projected['projection']).upper()} Projection")
+        # Choose the projection once and reproject every layer to it for measuring and plotting
+        chosen_projection = get_map_projection(mask_polygon)
+        projected_layers = project_layers(clipped_layers, chosen_projection)
+        trails_projected = calculate_trail_miles(projected_layers['mask'].geometry.iat[0],
+                                                 projected_layers['trails'])
+        plot_title =  (f"{trails_projected['trail_miles']} Miles of Trail"
+                       f" ({trails_projected['trail_density_per_mile']} Miles/ Square Mile)"
+                       f" Within Area of Interest Based on"
+                       f" {chosen_projection.upper()} Projection.")
 
     except ValueError as e:
+        # Still map the area, in longitude/latitude, when no projection covers it
+        projected_layers = clipped_layers
         plot_title = f'No trail miles found: {e}'
-    show(clipped_layers, plot_title)
     os.makedirs('trail-mileage-maps', exist_ok=True)
-    plt.savefig(f'trail-mileage-maps/{area}-trails.pdf')
+    with _FIGURE_LOCK:
+        figure = show(projected_layers, plot_title)
+        figure.savefig(f'trail-mileage-maps/{area}-trails.pdf', dpi=200)
     return 0
 
+def create_trail_mileage_maps(areas: list, feature_layers_payload: dict,
+                              max_workers: int = None) -> list:
+    """Create and save trail mileage maps for several areas of interest in parallel.
+    Args:
+        areas: A list of areas, each a list of four coordinates [north, south, east, west] or a
+            placename as a string.
+        feature_layers_payload: A dictionary used to find tags on OpenStreetMap.
+        max_workers: The maximum number of worker processes. Defaults to one per area, bounded
+            by the number of CPUs. A single area or worker is mapped in the current process.
+    Returns:
+        A list containing the result of create_trail_mileage_map() for each area, in order.
+    """
+    if max_workers is None:
+        max_workers = min(len(areas), os.cpu_count() or 1)
+
+    # A single area or worker gains nothing from starting a process pool
+    if len(areas) <= 1 or max_workers == 1:
+        return [create_trail_mileage_map(area, feature_layers_payload) for area in areas]
+
+    # Each area is independent, so run every map in its own process
+    create_map = functools.partial(create_trail_mileage_map,
+                                   feature_layers_payload=feature_layers_payload)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(create_map, areas))
+
 
 if __name__ == '__main__':
 
@@ -277,4 +639,4 @@ if __name__ == '__main__':
     BBOX = [NORTH_BOUND, SOUTH_BOUND, EAST_BOUND, WEST_BOUND]
     PLACENAME = 'Durango, Colorado, USA'
 
-    create_trail_mileage_map(BBOX, FEATURE_LAYERS_PAYLOAD)
+    create_trail_mileage_maps([BBOX], FEATURE_LAYERS_PAYLOAD)
@@ -1,13 +1,42 @@
 import pathlib
+import tempfile
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+import pytest
+import osmnx
 import geopandas as gpd
+import numpy as np
+import shapely
 from shapely.geometry import Polygon
-from shapely.geometry import LineString
 from map import create_mask
 from map import get_features
 from map import clip_layers
 from map import get_map_projection
 from map import filter_trails
+from map import _mask_from_place
+from map import create_trail_mileage_map
+from map import create_trail_mileage_maps
+from map import project_layers
+from map import calculate_trail_miles
+from map import show
+
+test_dir = pathlib.Path(__file__).resolve().parent
+
+# Share one osmnx response cache next to this file, whatever directory the tests run from
+osmnx.settings.use_cache = True
+osmnx.settings.cache_folder = str(test_dir / '.osmnx_cache')
+
+
+def osm_features(rows):
+	"""Build a GeoDataFrame shaped like an osmnx features response from (tags, geometry) pairs."""
+	return gpd.GeoDataFrame([tags for tags, _ in rows], geometry=[geometry for _, geometry in rows],
+							crs='EPSG:4326')
+
+
+def tearDownModule():
+	# Placename masks are memoized by map.py, drop them so later modules geocode afresh
+	_mask_from_place.cache_clear()
 
 
 class TestCreateMask(unittest.TestCase):
@@ -15,28 +44,30 @@ class TestCreateMask(unittest.TestCase):
 	def test_valid_bbox(self):
 		valid_bbox = [50.5, 49.5, -99.5, -100.5]
 		result = create_mask(valid_bbox)
-		self.assertEqual(type(result), gpd.GeoDataFrame)
-		self.assertEqual(type(result['geometry'].iloc[0]), Polygon)
+		self.assertIsInstance(result, gpd.GeoDataFrame)
+		self.assertEqual(result.geometry.geom_type.iat[0], 'Polygon')
 
+	@pytest.mark.network
 	def test_valid_placename(self):
 		valid_placename = "Globeville, Denver, Colorado, USA"
 		result = create_mask(valid_placename)
-		self.assertEqual(type(create_mask(valid_placename)), gpd.GeoDataFrame)
-		self.assertEqual(type(result['geometry'].iloc[0]), Polygon)
+		self.assertIsInstance(result, gpd.GeoDataFrame)
+		self.assertEqual(result.geometry.geom_type.iat[0], 'Polygon')
 
 	def test_invalid_bbox(self):
 		invalid_bbox = [1,2,3]
-		with self.assertRaises(ValueError):
+		with self.assertRaisesRegex(ValueError, 'exactly four coordinates'):
 			result = create_mask(invalid_bbox)
 
+	@pytest.mark.network
 	def test_invalid_placename(self):
 		invalid_placename = "Placename not found in OSM"
-		with self.assertRaises(Exception):
+		with self.assertRaisesRegex(ValueError, 'Unable to geocode area'):
 			result = create_mask(invalid_placename)
 
 	def test_invalid_type(self):
 		invalid_input_type = 100
-		with self.assertRaises(Exception):
+		with self.assertRaisesRegex(TypeError, 'string or list of four coordinates'):
 			result = create_mask(invalid_input_type)
 
 	# def test_out_of_bound_coordinates(self):
@@ -64,93 +95,288 @@ class TestGetFeatures(unittest.TestCase):
 	
 	valid_placename = "Globeville, Denver, Colorado, USA"
 
+	@pytest.mark.network
 	def test_valid_bbox(self):
 		#bbox around I-25 and I-70
 		valid_bbox = [39.78, 39.77, -104.98, -104.99]
-		result = get_features(valid_bbox, self.feature_layers_payload)
-		self.assertEqual(type(result), dict)
-		self.assertEqual(type(result.get('highways')), gpd.GeoDataFrame)
+		result = get_features(create_mask(valid_bbox), self.feature_layers_payload)
+		self.assertIsInstance(result, dict)
+		self.assertIsInstance(result.get('highways'), gpd.GeoDataFrame)
 
+	@pytest.mark.network
 	def test_valid_placename(self):
-		result = get_features(self.valid_placename, self.feature_layers_payload)
-		self.assertEqual(type(result), dict)
-		self.assertEqual(type(result.get('highways')), gpd.GeoDataFrame)
+		result = get_features(create_mask(self.valid_placename), self.feature_layers_payload)
+		self.assertIsInstance(result, dict)
+		self.assertIsInstance(result.get('highways'), gpd.GeoDataFrame)
 
+	@pytest.mark.network
 	def test_empty_result(self):
-		with self.assertRaises(Exception):	
-			result = get_features(self.valid_placename, self.empty_result_payload)
+		with self.assertRaisesRegex(ValueError, 'No feature layers were fetched'):
+			result = get_features(create_mask(self.valid_placename), self.empty_result_payload)
 
 	def test_invalid_payload(self):
-		with self.assertRaises(Exception):	
-			result = get_features(self.valid_placename, self.invalid_payload)
+		# The payload is rejected before the mask is used, so a bbox keeps this test offline
+		valid_bbox = [39.78, 39.77, -104.98, -104.99]
+		with self.assertRaisesRegex(TypeError, 'dictionary of OpenStreetMap tags'):
+			result = get_features(create_mask(valid_bbox), self.invalid_payload)
 
 
-class TestClipLayers(unittest.TestCase):
+class TestFetchLayers(unittest.TestCase):
 
-	# Create mock inputs for clip_layers
-	test_line_in_bounds = LineString([(1,1), (1,5)])
-	test_line_out_of_bounds = LineString([(8,1), (8,20)])
-	test_polygon_in_bounds = Polygon([(2,2),(4,2),(3,3)])
-	test_polygon_out_of_bounds = Polygon([(5,8),(7,8),(6,20)])
+	# Tag values are given as a list, a string and True, and 'highway' and 'building' are shared
+	feature_layers_payload = {
+		'trails': {'highway': ['path']},
+		'highways': {'highway': 'motorway'},
+		'buildings': {'building': True},
+		'houses': {'building': ['house']},
+		'water': {'natural': ['water'], 'waterway': ['river']},
+		'parks': {'leisure': ['park']}
+	}
 
-	test_lines_gdf = gpd.GeoDataFrame({'geometry' : [test_line_in_bounds, test_line_out_of_bounds]})
-	test_polygons_gdf = gpd.GeoDataFrame({'geometry' : [test_polygon_in_bounds, test_polygon_out_of_bounds]})
+	def setUp(self):
+		# Keep the layer cache of each test in its own folder so every test queries Overpass
+		cache_folder = tempfile.TemporaryDirectory()
+		self.addCleanup(cache_folder.cleanup)
+		self.cache_folder = pathlib.Path(cache_folder.name)
+		cache_patch = mock.patch('map._LAYER_CACHE_FOLDER', self.cache_folder)
+		cache_patch.start()
+		self.addCleanup(cache_patch.stop)
+		self.mask = create_mask([1, 0, 1, 0])
+
+	def fetch(self, features):
+		with mock.patch('map.osmnx.features.features_from_polygon',
+						return_value=features) as features_from_polygon:
+			result = get_features(self.mask, self.feature_layers_payload)
+		return result, features_from_polygon
+
+	def test_single_query(self):
+		features = osm_features([
+			({'highway': 'path', 'surface': 'dirt', 'name': 'Trail'},
+			 shapely.LineString([(0.1,0.1), (0.2,0.2)])),
+			({'highway': 'motorway'}, shapely.LineString([(0.3,0.3), (0.4,0.4)])),
+			({'building': 'yes'}, shapely.box(0.5, 0.5, 0.6, 0.6)),
+			({'building': 'house'}, shapely.box(0.6, 0.6, 0.7, 0.7)),
+			({'natural': 'water'}, shapely.box(0.1, 0.5, 0.2, 0.6)),
+			({'waterway': 'river'}, shapely.LineString([(0.8,0.1), (0.9,0.2)]))
+		])
+		result, features_from_polygon = self.fetch(features)
+
+		# Every layer's tags are merged into one query, where True matches any value of a key
+		features_from_polygon.assert_called_once()
+		self.assertEqual(features_from_polygon.call_args.kwargs['tags'], {
+			'highway': ['path', 'motorway'],
+			'building': True,
+			'natural': ['water'],
+			'waterway': ['river'],
+			'leisure': ['park']
+		})
+
+		self.assertEqual(result['trails']['highway'].tolist(), ['path'])
+		self.assertEqual(len(result['highways']), 1)
+		self.assertEqual(len(result['buildings']), 2)
+		self.assertEqual(len(result['houses']), 1)
+		self.assertEqual(len(result['water']), 2)
+
+		# No feature has a 'leisure' column, so the empty parks layer is left out
+		self.assertNotIn('parks', result)
+
+		# Only trails keep their highway and surface tags, every other layer keeps its geometry
+		self.assertEqual(result['trails'].columns.tolist(), ['highway', 'surface', 'geometry'])
+		self.assertEqual(result['buildings'].columns.tolist(), ['geometry'])
+
+	def test_cached_layers(self):
+		features = osm_features([({'highway': 'path'}, shapely.LineString([(0.1,0.1), (0.2,0.2)]))])
+		first_result, _ = self.fetch(features)
+		second_result, features_from_polygon = self.fetch(features)
+
+		# The second call over the same area reads every layer from the cache without Overpass
+		features_from_polygon.assert_not_called()
+		self.assertEqual(list(second_result), list(first_result))
+		self.assertTrue(second_result['trails'].geom_equals(first_result['trails']).all())
+
+		# Layers are moved into place once written, leaving no partial files behind
+		cached_files = [path.suffix for path in self.cache_folder.iterdir()]
+		self.assertEqual(cached_files, ['.parquet'] * len(self.feature_layers_payload))
+
+	def test_missing_columns(self):
+		features = osm_features([({'highway': 'path'}, shapely.LineString([(0.1,0.1), (0.2,0.2)]))])
+		result, _ = self.fetch(features)
+
+		# Columns that the response doesn't contain are skipped instead of raising a KeyError
+		self.assertEqual(result['trails'].columns.tolist(), ['highway', 'geometry'])
+		self.assertEqual(list(result), ['trails'])
 
-	layers_to_clip = {
-		'lines' : test_lines_gdf,
-		'polygons' : test_polygons_gdf
-	}
 
-	mask_polygon = Polygon([(0,0),(0,10),(5,25),(10 ,10),(10,0)])
-	mask_gdf = gpd.GeoDataFrame({'geometry' : [mask_polygon]})
+class TestClipLayers(unittest.TestCase):
 
-	def test_clip_layers(self):
-		#maybe floor these to make sure contains() doesn't mess up math
-		result = clip_layers(self.mask_gdf, self.layers_to_clip)
-		self.assertEqual(type(result), dict)
-		clipped_lines = gpd.GeoSeries(result['lines']['geometry'])
-		clipped_polygons = gpd.GeoSeries(result['polygons']['geometry'])
+	@classmethod
+	def setUpClass(cls):
+		# Create mock inputs for clip_layers once for the whole class, the first geometry of each
+		# layer lies inside the mask and the second crosses its boundary
+		test_lines = shapely.linestrings(np.array([[(1,1), (1,5)], [(8,1), (8,20)]]))
+		test_polygons = shapely.polygons(np.array([[(2,2),(4,2),(3,3)], [(5,8),(7,8),(6,20)]]))
 
-		lines_clipped_correctly = self.mask_gdf['geometry'].contains(clipped_lines.all()).iloc[0]
-		self.assertEqual(lines_clipped_correctly, True)
-		polygons_clipped_correctly = self.mask_gdf['geometry'].contains(clipped_polygons[1]).iloc[0]
-		self.assertEqual(polygons_clipped_correctly, True)
+		test_lines_gdf = gpd.GeoDataFrame(geometry=gpd.array.from_shapely(test_lines))
+		test_polygons_gdf = gpd.GeoDataFrame(geometry=gpd.array.from_shapely(test_polygons))
 
+		cls.layers_to_clip = {
+			'lines' : test_lines_gdf,
+			'polygons' : test_polygons_gdf
+		}
 
-class TestMapProjection(unittest.TestCase):
+		# Build each layer's spatial index once, every clip_layers call in the class reuses it
+		for gdf in cls.layers_to_clip.values():
+			gdf.sindex
 
-	def test_epsg2774(self):
-		polygon = Polygon([(-107.915, 37.25),(-107.915, 37.35),(-107.81, 37.35),(-107.81, 37.25)])
-		mask = gpd.GeoDataFrame({'geometry' : [polygon]})
-		result = get_map_projection(mask)
-		self.assertEqual(result, 'EPSG:2774')
+		cls.mask_polygon = Polygon([(0,0),(0,10),(5,25),(10 ,10),(10,0)])
 
+	def test_clip_layers(self):
+		result = clip_layers(self.mask_polygon, self.layers_to_clip)
+		self.assertIsInstance(result, dict)
+
+		# Every fixture geometry reaches into the mask, so each layer keeps both of its rows and
+		# every clipped geometry lies within the mask
+		for layer in ['lines', 'polygons']:
+			clipped_geometries = result[layer].geometry.to_numpy()
+			self.assertEqual(len(clipped_geometries), 2)
+			self.assertTrue(shapely.contains(self.mask_polygon, clipped_geometries).all())
+
+		# The second line crosses the mask's upper right edge at (8, 16) and is cut there
+		crossing_line = result['lines'].geometry.iat[1]
+		self.assertTrue(shapely.equals(crossing_line, shapely.LineString([(8,1), (8,16)])))
+
+
+	def test_clip_layers_bbox(self):
+		mask_box = shapely.box(0, 0, 9, 10)
+		with mock.patch('map.shapely.clip_by_rect', wraps=shapely.clip_by_rect) as clip_by_rect:
+			result = clip_layers(mask_box, self.layers_to_clip)
+		self.assertTrue(clip_by_rect.called)
+
+		# Rectangle clipping gives the same geometries as intersecting with the mask
+		for layer in ['lines', 'polygons']:
+			expected = shapely.intersection(self.layers_to_clip[layer].geometry.to_numpy(), mask_box)
+			expected = expected[~shapely.is_empty(expected)]
+			self.assertEqual(len(result[layer]), len(expected))
+			self.assertTrue(shapely.equals(result[layer].geometry.to_numpy(), expected).all())
+
+	def test_clip_layers_bbox_touching(self):
+		# A line meeting the rectangle only along its edge is dropped rather than kept as empty
+		mask_box = shapely.box(0, 0, 9, 10)
+		touching_lines = shapely.linestrings(np.array([[(9,5), (12,5)]]))
+		touching_gdf = gpd.GeoDataFrame(geometry=gpd.array.from_shapely(touching_lines))
+		result = clip_layers(mask_box, {'lines' : touching_gdf})
+		self.assertTrue(result['lines'].empty)
+
+
+class TestProjectLayers(unittest.TestCase):
+
+	def test_project_layers(self):
+		trails = osm_features([({'highway': 'path'},
+								 shapely.LineString([(-107.9, 37.3), (-107.85, 37.3)]))])
+		mask = gpd.GeoDataFrame(geometry=[shapely.box(-107.915, 37.25, -107.81, 37.35)], crs='EPSG:4326')
+		result = project_layers({'trails': trails, 'mask': mask}, 'EPSG:2774')
+
+		# Every layer keeps its attributes and matches reprojecting it with GeoPandas
+		for tag, layer in {'trails': trails, 'mask': mask}.items():
+			self.assertEqual(result[tag].crs, 'EPSG:2774')
+			self.assertEqual(result[tag].columns.tolist(), layer.columns.tolist())
+			expected = layer.to_crs('EPSG:2774').geometry.to_numpy()
+			self.assertTrue(shapely.equals_exact(result[tag].geometry.to_numpy(), expected, 1e-6).all())
+
+
+class TestCalculateTrailMiles(unittest.TestCase):
+
+	# Inputs are in a projected CRS measured in meters
+	mile = 1609.344
+
+	def setUp(self):
+		trail_lines = shapely.linestrings(np.array([[(0, 0), (self.mile, 0)], [(0, 0), (0, self.mile)]]))
+		self.trails = gpd.GeoDataFrame(geometry=gpd.array.from_shapely(trail_lines))
+
+	def test_polygon(self):
+		result = calculate_trail_miles(shapely.box(0, 0, self.mile, self.mile), self.trails)
+		self.assertEqual(result, {'trail_miles': 2.0, 'trail_density_per_mile': 2.0})
+
+	def test_multipolygon(self):
+		# Trail density is also calculated for areas made of several polygons
+		mask = shapely.MultiPolygon([shapely.box(0, 0, self.mile, self.mile),
+									 shapely.box(2 * self.mile, 0, 3 * self.mile, self.mile)])
+		result = calculate_trail_miles(mask, self.trails)
+		self.assertEqual(result, {'trail_miles': 2.0, 'trail_density_per_mile': 1.0})
+
+
+@pytest.mark.parametrize('bounds, expected_projection', [
+	((-107.915, 37.25, -107.81, 37.35), 'EPSG:2774'),
+	((137.23, -26.92, 137.24, -26.91), 'EPSG:3395'),
+])
+def test_map_projection(bounds, expected_projection):
+	assert get_map_projection(shapely.box(*bounds)) == expected_projection
+
+
+def test_map_projection_uncovered():
+	# No projection in the catalog reaches past 84 degrees north
+	with pytest.raises(ValueError, match='No available projection'):
+		get_map_projection(shapely.box(0, 85, 1, 86))
+
+
+def test_create_trail_mileage_map_uncovered(tmp_path, monkeypatch):
+	# Areas without a projection are still mapped, titled without any trail mileage
+	monkeypatch.chdir(tmp_path)
+	polar_area = [86, 85, 1, 0]
+	features = osm_features([({'highway': 'path', 'surface': 'dirt'},
+							   shapely.LineString([(0.2, 85.2), (0.8, 85.8)]))])
+	with mock.patch('map.osmnx.features.features_from_polygon', return_value=features), \
+			mock.patch('map.show', wraps=show) as show_map:
+		create_trail_mileage_map(polar_area, {'trails': {'highway': ['path']}})
+	assert show_map.call_args.args[1].startswith('No trail miles found')
+	assert (tmp_path / 'trail-mileage-maps' / f'{polar_area}-trails.pdf').exists()
+
+
+class TestCreateTrailMileageMaps(unittest.TestCase):
+
+	areas = [[2, 1, 2, 1], 'Durango, Colorado, USA', [4, 3, 4, 3]]
+	feature_layers_payload = {'trails': {'highway': ['path']}}
+
+	def test_parallel(self):
+		# Threads stand in for processes so the patched map function is shared with the workers
+		with mock.patch('map.create_trail_mileage_map', return_value=0) as create_map, \
+				mock.patch('map.ProcessPoolExecutor', ThreadPoolExecutor):
+			result = create_trail_mileage_maps(self.areas, self.feature_layers_payload)
+		self.assertEqual(result, [0, 0, 0])
+		self.assertCountEqual([call.args[0] for call in create_map.call_args_list], self.areas)
 
-	def test_epsg3395(self):
-		polygon = Polygon([(137.23, -26.91),(137.23, -26.92),(137.24, -26.92),(137.24, -26.91)])
-		mask = gpd.GeoDataFrame({'geometry' : [polygon]})
-		result = get_map_projection(mask)
-		self.assertEqual(result, 'EPSG:3395')
+	def test_single_area(self):
+		# A single area is mapped in the current process without starting a pool
+		with mock.patch('map.create_trail_mileage_map', return_value=0) as create_map, \
+				mock.patch('map.ProcessPoolExecutor') as process_pool:
+			result = create_trail_mileage_maps(self.areas[:1], self.feature_layers_payload)
+		self.assertEqual(result, [0])
+		create_map.assert_called_once_with(self.areas[0], self.feature_layers_payload)
+		process_pool.assert_not_called()
+
+	def test_no_areas(self):
+		self.assertEqual(create_trail_mileage_maps([], self.feature_layers_payload), [])
 
 
 class TestFilterTrails(unittest.TestCase):
-	test_data = pathlib.Path().resolve() / 'test_data'
-	unfiltered_trails = gpd.read_file(f'{test_data}/test_trails.geojson')
-	filtered_trails = filter_trails(unfiltered_trails)
+
+	@classmethod
+	def setUpClass(cls):
+		cls.unfiltered_trails = gpd.read_file(test_dir / 'test_data' / 'test_trails.geojson',
+											  engine='pyogrio')
+		cls.filtered_trails = filter_trails(cls.unfiltered_trails)
 
 	def test_fetched_paths(self):
-		self.assertTrue(self.filtered_trails.loc[self.filtered_trails['highway'] == 'path'].bool)
+		self.assertTrue((self.filtered_trails['highway'] == 'path').any())
 
 	def test_fetched_footways(self):
-		self.assertTrue(self.filtered_trails.loc[self.filtered_trails['highway'] == 'footway'].bool)
+		self.assertTrue((self.filtered_trails['highway'] == 'footway').any())
 
 	def test_filter_footways(self):
-		footways = self.filtered_trails.loc[self.filtered_trails['highway'] == 'footway']
-
-		self.assertTrue(footways.loc[footways['surface'] == 'concrete'].empty)
-		self.assertTrue(footways.loc[footways['surface'] == 'asphalt'].empty)
-		self.assertTrue(footways.loc[footways['surface'] == 'paved'].empty)
+		footways = self.filtered_trails['highway'] == 'footway'
+		footway_surfaces = self.filtered_trails.loc[footways, 'surface']
+		self.assertFalse(footway_surfaces.isin({'concrete', 'asphalt', 'paved'}).any())
 
 
 if __name__ == '__main__':
-    unittest.main()
+    pytest.main([__file__])